@@ -1,7 +1,7 @@
 import torch
 
 version = "2023/01/04-#01"
-cache_file = "cache/results.json"
+cache_file = "cache/results.jsonl"
 hf_cache_dir = None
 
 # # 8xV100 & Llama-2-7B
@@ -3,16 +3,32 @@ import gc
 import json
 import math
 import torch
+import hashlib
+import torch.distributed as dist
 from tqdm import tqdm
 from typing import Optional, Any
 from torch.nn import functional as F
 from functools import cached_property
 from dataclasses import dataclass, asdict
-from transformers import LlamaForCausalLM
+from transformers import LlamaForCausalLM, DynamicCache
 from qa_dataset import QADataset, Question
 from quantizer import Quantizer, AttentionType
 
 
+# Returns the length-normalized log probability of every choice.
+# Compiled with dynamic shapes (question/choice lengths vary) so the softmax,
+# gathers, masking and reduction fuse into a few kernels instead of a dozen
+# separate launches per question.
+@torch.compile(dynamic=True)
+def _calc_log_probabilities(first_word_logits: torch.Tensor, quantized_logits: torch.Tensor, suffix_input_ids: torch.Tensor, choice_lens: torch.Tensor) -> torch.Tensor:
+    first_word_log_softmax = F.log_softmax(first_word_logits, dim=-1)
+    quantized_log_softmax = F.log_softmax(quantized_logits, dim=-1)
+    first_log_probability = first_word_log_softmax.gather(1, suffix_input_ids[:, :1]).squeeze(-1)
+    rest_log_probability = quantized_log_softmax.gather(2, suffix_input_ids[:, 1:].unsqueeze(-1)).squeeze(-1)
+    rest_mask = torch.arange(suffix_input_ids.shape[1]-1, device=suffix_input_ids.device) < (choice_lens - 1).unsqueeze(-1)
+    return (first_log_probability + (rest_log_probability * rest_mask).sum(dim=-1)) / choice_lens
+
+
 @dataclass
 class EvaluationResult:
     accuracy: float = 0.0
@@ -37,13 +53,27 @@ class Evaluator:
                  model_name: str,
                  datasets: QADataset,
                  key_quantizer: Quantizer,
-                 value_quantizer: Quantizer):
+                 value_quantizer: Quantizer,
+                 measure_attention_error: bool = False,
+                 # Round the reference KV cache to this dtype (e.g. torch.bfloat16
+                 # or torch.float8_e4m3fn) before quantization and error metrics,
+                 # to match the precision a production cache would actually ship in;
+                 # None keeps the model's own cache dtype
+                 reference_dtype: Optional[torch.dtype] = None):
         self.device = device
         self.version = version
         self.model_name = model_name
         self.datasets = datasets
         self.key_quantizer = key_quantizer
         self.value_quantizer = value_quantizer
+        self.measure_attention_error = measure_attention_error
+        self.reference_dtype = reference_dtype
+        # output_attentions=True forces eager attention and materializes the full
+        # (n_batch, n_head, seq_len, seq_len) maps, so only request them when a
+        # quantizer is attention-aware or the attention error metric is wanted.
+        self._need_attentions = measure_attention_error \
+            or (key_quantizer.level != "no-quantization" and key_quantizer.use_attentions) \
+            or (value_quantizer.level != "no-quantization" and value_quantizer.use_attentions)
 
     @cached_property
     def params(self) -> dict[str, Any]:
@@ -54,132 +84,323 @@ class Evaluator:
         res["question_count"] = self.datasets.question_count
         res["key_quantizer"] = self.key_quantizer.params
         res["value_quantizer"] = self.value_quantizer.params
+        # Only recorded when set so that existing cached results keep matching
+        if self.reference_dtype is not None:
+            res["reference_dtype"] = str(self.reference_dtype)
         return res
 
-    def _calc_tensor_error(self, tensor1: torch.Tensor, tensor2: torch.Tensor) -> float:
-        return ((tensor1.to(self.device) - tensor2.to(self.device)) ** 2).mean().item()
+    def _calc_tensor_error(self, tensor1: torch.Tensor, tensor2: torch.Tensor) -> torch.Tensor:
+        # Both tensors are expected to live on self.device already; the result
+        # stays on device so the caller decides when to sync
+        return F.mse_loss(tensor1, tensor2)
+
+    def _calc_attention_error(self, attention1: AttentionType, attention2: AttentionType) -> torch.Tensor:
+        # Takes narrow'd views and reduces them directly, so no staging copy of
+        # the attention maps is ever materialized; the per-layer accumulation
+        # stays on device
+        error = torch.zeros((), device=self.device)
+        for attn1, attn2 in zip(attention1, attention2):
+            error = error + F.mse_loss(attn1, attn2)
+        return error / len(attention1)
 
-    def _calc_attention_error(self, attention1: AttentionType, attention2: AttentionType) -> float:
-        return sum(self._calc_tensor_error(attn1, attn2) for attn1, attn2 in zip(attention1, attention2)) / len(attention1)
+    # Collates all choices of all questions into one batch with right padding,
+    # so every question prefix stays at positions [0:question_len) and the
+    # causal mask keeps valid positions independent of trailing pad tokens
+    def _collate_input_ids(self, questions: list[Question]) -> torch.Tensor:
+        pad_token_id = self.datasets.tokenizer.pad_token_id
+        n_rows = sum(question.input_ids.shape[0] for question in questions)
+        max_seq_len = max(question.input_ids.shape[1] for question in questions)
+        input_ids = torch.full((n_rows, max_seq_len), pad_token_id, dtype=torch.int64, device=self.device)
+        row_start = 0
+        for question in questions:
+            n_choices, seq_len = question.input_ids.shape
+            input_ids[row_start:row_start+n_choices, :seq_len].copy_(question.input_ids, non_blocking=True)
+            row_start += n_choices
+        return input_ids
 
-    def _evaluate_single(self, model: LlamaForCausalLM, question: Question) -> EvaluationResult:
-        question_len = question.question_length
+    # Returns one metric row per question, on device, with the column layout
+    # consumed by evaluate() below
+    def _evaluate_batch(self, model: LlamaForCausalLM, questions: list[Question], input_ids: torch.Tensor) -> torch.Tensor:
+        pad_token_id = self.datasets.tokenizer.pad_token_id
+        question_lens = [question.question_length for question in questions]
+        seq_lens = [question.input_ids.shape[1] for question in questions]
+        row_offsets = [0]
+        for question in questions:
+            row_offsets.append(row_offsets[-1] + question.input_ids.shape[0])
+        n_rows, max_question_len = row_offsets[-1], max(question_lens)
+        max_choice_len = max(seq_len - question_len for seq_len, question_len in zip(seq_lens, question_lens))
         # Forward before quantization
-        input_ids = question.input_ids.to(self.device)
-        result = model.forward(input_ids, use_cache=True, output_attentions=True, return_dict=True)
-        # Quantize key/value cache
-        question_attentions = [attn[:,:,:question_len,:question_len].to(self.device) for attn in result.attentions]
-        key_cache = torch.stack([key[:,:,:question_len,:].to(self.device) for key, _ in result.past_key_values])
-        value_cache = torch.stack([value[:,:,:question_len,:].to(self.device) for _, value in result.past_key_values])
-        quantized_key_cache, key_average_n_bits = self.key_quantizer.quantize(key_cache, question_attentions)
-        quantized_value_cache, value_average_n_bits = self.value_quantizer.quantize(value_cache, question_attentions)
-        quantized_kvcache = [
-            (key.to(result.past_key_values[idx][0].device), value.to(result.past_key_values[idx][0].device))
-            for idx, (key, value) in enumerate(zip(quantized_key_cache, quantized_value_cache))
-        ]
-        # Forward after quantization
-        quantized_result = model.forward(input_ids[:,question_len:], past_key_values=quantized_kvcache, use_cache=True, output_attentions=True, return_dict=True)
-        # Calculate log probabilities
-        first_word_log_softmax = F.log_softmax(result.logits[:,question_len-1], dim=-1)
-        quantized_log_softmax = F.log_softmax(quantized_result.logits, dim=-1)
-        max_log_probability, max_choice_idx, answer_log_probability = None, None, None
-        for choice_idx, choice_len in enumerate(question.choice_length):
-            quantized_log_probability = first_word_log_softmax[choice_idx, input_ids[choice_idx, question_len]].item()
-            quantized_log_probability += quantized_log_softmax[choice_idx, torch.arange(choice_len-1), input_ids[choice_idx,question_len+1:question_len+choice_len]].sum().item()
-            quantized_log_probability /= choice_len
-            if choice_idx == question.answer_idx:
-                answer_log_probability = quantized_log_probability
-            if max_log_probability is None or quantized_log_probability > max_log_probability:
-                max_log_probability = quantized_log_probability
-                max_choice_idx = choice_idx
-        # Calculate quantization metrics
-        key_quantization_error = self._calc_tensor_error(key_cache, quantized_key_cache)
-        value_quantization_error = self._calc_tensor_error(value_cache, quantized_value_cache)
-        attention_error = self._calc_attention_error(
-            [attn[:,:,question_len:,:question_len].to(self.device) for attn in result.attentions],
-            [attn[:,:,:,:question_len].to(self.device) for attn in quantized_result.attentions],
-        )
-        logit_error = self._calc_tensor_error(result.logits[:,question_len:,:], quantized_result.logits)
-        key_average_size = self.key_quantizer.calc_quantized_cache_size_per_token(key_average_n_bits, model)
-        value_average_size = self.value_quantizer.calc_quantized_cache_size_per_token(value_average_n_bits, model)
+        result = model.forward(input_ids, use_cache=True, output_attentions=self._need_attentions, return_dict=True)
+        if self._need_attentions:
+            # Attentions are consumed as-is without per-layer device transfers
+            assert all(attn.device == self.device for attn in result.attentions)
+        n_layer = len(result.past_key_values)
+        _, n_head, _, embed_size_per_head = result.past_key_values[0][0].shape
+        cache_dtype = self.reference_dtype if self.reference_dtype is not None else result.past_key_values[0][0].dtype
+        key_cache = torch.empty((n_layer, n_rows, n_head, max_question_len, embed_size_per_head), dtype=cache_dtype, device=self.device)
+        value_cache = torch.empty((n_layer, n_rows, n_head, max_question_len, embed_size_per_head), dtype=cache_dtype, device=self.device)
+        for layer_idx, (key, value) in enumerate(result.past_key_values):
+            key_cache[layer_idx].copy_(key[:,:,:max_question_len,:], non_blocking=True)
+            value_cache[layer_idx].copy_(value[:,:,:max_question_len,:], non_blocking=True)
+        # Only the first-word row and the choice-suffix rows of the FP32 logits
+        # are ever used; extract those and release the full (n_rows, seq_len,
+        # vocab) tensor before the second forward allocates its own logits
+        vocab_size = result.logits.shape[-1]
+        first_word_logits = torch.empty((n_rows, vocab_size), dtype=result.logits.dtype, device=self.device)
+        suffix_logits = torch.zeros((n_rows, max_choice_len, vocab_size), dtype=result.logits.dtype, device=self.device)
+        for question_idx, (question_len, seq_len, row_start) in enumerate(zip(question_lens, seq_lens, row_offsets)):
+            row_end = row_offsets[question_idx+1]
+            first_word_logits[row_start:row_end].copy_(result.logits[row_start:row_end, question_len-1], non_blocking=True)
+            suffix_logits[row_start:row_end, :seq_len-question_len].copy_(result.logits[row_start:row_end, question_len:seq_len], non_blocking=True)
+        past_kvcache = result.past_key_values
+        prefill_attentions = result.attentions
+        del result
+        # Quantize key/value cache question by question, since normalization
+        # ranges and bit allocations must not leak across questions
+        quantized_key_cache = torch.zeros_like(key_cache)
+        quantized_value_cache = torch.zeros_like(value_cache)
+        key_average_n_bits_list: list[float] = []
+        value_average_n_bits_list: list[float] = []
+        key_quantization_error_list: list[torch.Tensor] = []
+        value_quantization_error_list: list[torch.Tensor] = []
+        for question_idx, (question_len, row_start) in enumerate(zip(question_lens, row_offsets)):
+            row_end = row_offsets[question_idx+1]
+            question_attentions = [attn[row_start:row_end,:,:question_len,:question_len] for attn in prefill_attentions] if self._need_attentions else None
+            quantized_key, key_average_n_bits = self.key_quantizer.quantize(key_cache[:,row_start:row_end,:,:question_len,:], question_attentions)
+            quantized_value, value_average_n_bits = self.value_quantizer.quantize(value_cache[:,row_start:row_end,:,:question_len,:], question_attentions)
+            # Measure the quantization error right away so the raw caches can
+            # be freed before the second forward
+            key_quantization_error_list.append(self._calc_tensor_error(key_cache[:,row_start:row_end,:,:question_len,:], quantized_key))
+            value_quantization_error_list.append(self._calc_tensor_error(value_cache[:,row_start:row_end,:,:question_len,:], quantized_value))
+            quantized_key_cache[:,row_start:row_end,:,:question_len,:] = quantized_key
+            quantized_value_cache[:,row_start:row_end,:,:question_len,:] = quantized_value
+            key_average_n_bits_list.append(key_average_n_bits)
+            value_average_n_bits_list.append(value_average_n_bits)
+        del key_cache, value_cache
+        if not self.measure_attention_error:
+            # Past this point the prefill attentions are only needed for the
+            # attention error metric
+            prefill_attentions = None
+        # Forward after quantization: all choice suffixes run in one batch, with
+        # padded past positions masked out and positions re-based per question
+        suffix_input_ids = torch.full((n_rows, max_choice_len), pad_token_id, dtype=torch.int64, device=self.device)
+        attention_mask = torch.zeros((n_rows, max_question_len + max_choice_len), dtype=torch.int64, device=self.device)
+        position_ids = torch.zeros((n_rows, max_choice_len), dtype=torch.int64, device=self.device)
+        for question_idx, (question_len, seq_len, row_start) in enumerate(zip(question_lens, seq_lens, row_offsets)):
+            row_end = row_offsets[question_idx+1]
+            suffix_input_ids[row_start:row_end, :seq_len-question_len] = input_ids[row_start:row_end, question_len:seq_len]
+            attention_mask[row_start:row_end, :question_len] = 1
+            attention_mask[row_start:row_end, max_question_len:max_question_len+seq_len-question_len] = 1
+            position_ids[row_start:row_end] = torch.arange(question_len, question_len + max_choice_len, device=self.device)
+        # Filled layer by layer straight from the stacked caches, skipping the
+        # legacy list-of-tuples representation
+        # The model always consumes the cache in its own dtype, even when the
+        # reference lives in a lower-precision dtype for the error metrics
+        quantized_kvcache = DynamicCache()
+        for layer_idx, (key, _) in enumerate(past_kvcache):
+            quantized_kvcache.update(
+                quantized_key_cache[layer_idx].to(device=key.device, dtype=key.dtype),
+                quantized_value_cache[layer_idx].to(device=key.device, dtype=key.dtype),
+                layer_idx,
+            )
+        # Release the original prefill KV cache before the second forward; only
+        # the quantized copy is consumed from here on
+        del past_kvcache
+        # use_cache=False drops the output cache of the suffix tokens, which is
+        # never read; the model skips the legacy-cache conversion in that case,
+        # so the past is wrapped in a DynamicCache and the cache positions are
+        # passed explicitly
+        cache_position = torch.arange(max_question_len, max_question_len + max_choice_len, device=self.device)
+        quantized_result = model.forward(suffix_input_ids, past_key_values=quantized_kvcache, attention_mask=attention_mask, position_ids=position_ids, cache_position=cache_position, use_cache=False, output_attentions=self.measure_attention_error, return_dict=True)
+        # Calculate per-question metrics, all kept on device
+        metric_rows: list[torch.Tensor] = []
+        for question_idx, (question, question_len, seq_len, row_start) in enumerate(zip(questions, question_lens, seq_lens, row_offsets)):
+            row_end = row_offsets[question_idx+1]
+            # Calculate log probabilities for all choices at once
+            suffix_len = seq_len - question_len
+            choice_lens = torch.tensor(question.choice_length, device=self.device)
+            log_probabilities = _calc_log_probabilities(
+                first_word_logits[row_start:row_end],
+                quantized_result.logits[row_start:row_end, :suffix_len-1],
+                suffix_input_ids[row_start:row_end, :suffix_len],
+                choice_lens,
+            )
+            accuracy = (log_probabilities.argmax() == question.answer_idx).float()
+            answer_log_probability = log_probabilities[question.answer_idx]
+            # Calculate quantization metrics
+            key_quantization_error = key_quantization_error_list[question_idx]
+            value_quantization_error = value_quantization_error_list[question_idx]
+            if self.measure_attention_error:
+                choice_len_max = seq_len - question_len
+                attention_error = self._calc_attention_error(
+                    [attn[row_start:row_end].narrow(2, question_len, choice_len_max).narrow(3, 0, question_len) for attn in prefill_attentions],
+                    [attn[row_start:row_end].narrow(2, 0, choice_len_max).narrow(3, 0, question_len) for attn in quantized_result.attentions],
+                )
+            else:
+                attention_error = torch.tensor(float("nan"), device=self.device)
+            logit_error = self._calc_tensor_error(suffix_logits[row_start:row_end, :suffix_len, :], quantized_result.logits[row_start:row_end, :suffix_len, :])
+            key_average_n_bits = key_average_n_bits_list[question_idx]
+            value_average_n_bits = value_average_n_bits_list[question_idx]
+            key_average_size = self.key_quantizer.calc_quantized_cache_size_per_token(key_average_n_bits, model)
+            value_average_size = self.value_quantizer.calc_quantized_cache_size_per_token(value_average_n_bits, model)
+            device_metrics = torch.stack([
+                accuracy.float(),
+                answer_log_probability.float(),
+                ((key_quantization_error + value_quantization_error) / 2).float(),
+                key_quantization_error.float(),
+                value_quantization_error.float(),
+                attention_error.float(),
+                logit_error.float(),
+            ])
+            host_metrics = torch.tensor([
+                (key_average_size + value_average_size) / 2,
+                key_average_size,
+                value_average_size,
+                (key_average_n_bits + value_average_n_bits) / 2,
+                key_average_n_bits,
+                value_average_n_bits,
+            ], device=self.device)
+            metric_rows.append(torch.cat([device_metrics, host_metrics]))
+        return torch.stack(metric_rows)
+
+    # Returns (metric totals on device, total question tokens)
+    def _accumulate_metrics(self, model: LlamaForCausalLM, questions: list[Question], use_tqdm: bool, batch_size: int) -> tuple[torch.Tensor, int]:
+        total_tokens = 0
+        n_questions = 0
+        batches = [questions[idx:idx+batch_size] for idx in range(0, len(questions), batch_size)]
+        # Metric totals are accumulated on device and synced to the host once
+        # after the loop; columns 0-6 are averaged per question, columns 7-12
+        # are weighted by question length
+        totals = torch.zeros(13, dtype=torch.float64, device=self.device)
+        # Input ids are collated one batch ahead on a side stream, overlapping
+        # the host-to-device copy (from pinned memory) with the current forward
+        copy_stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        def collate(batch: list[Question]) -> torch.Tensor:
+            if copy_stream is None:
+                return self._collate_input_ids(batch)
+            with torch.cuda.stream(copy_stream):
+                return self._collate_input_ids(batch)
+        # inference_mode also skips view/version tracking, which no_grad keeps
+        with torch.inference_mode():
+            next_input_ids = collate(batches[0]) if batches else None
+            for batch_idx, batch in enumerate(tqdm(batches) if use_tqdm else batches):
+                input_ids = next_input_ids
+                if copy_stream is not None:
+                    torch.cuda.current_stream(self.device).wait_stream(copy_stream)
+                    input_ids.record_stream(torch.cuda.current_stream(self.device))
+                if batch_idx + 1 < len(batches):
+                    next_input_ids = collate(batches[batch_idx + 1])
+                metrics = self._evaluate_batch(model, batch, input_ids).to(torch.float64)
+                n_tokens = torch.tensor([question.question_length for question in batch], dtype=torch.float64, device=self.device)
+                weights = torch.ones_like(metrics)
+                weights[:, 7:] = n_tokens.unsqueeze(-1)
+                totals += (metrics * weights).sum(dim=0)
+                total_tokens += sum(question.question_length for question in batch)
+                n_questions += len(batch)
+                if n_questions // 100 > (n_questions - len(batch)) // 100:
+                    gc.collect()
+        return totals, total_tokens
+
+    def _build_result(self, totals: list[float], total_tokens: int) -> EvaluationResult:
+        (accuracy, answer_log_probability, quantization_error, key_quantization_error,
+         value_quantization_error, attention_error, logit_error,
+         average_size, key_average_size, value_average_size,
+         average_n_bits, key_average_n_bits, value_average_n_bits) = totals
+        question_count = self.datasets.question_count
+        accuracy /= question_count
         return EvaluationResult(
-            accuracy=1.0 if max_choice_idx == question.answer_idx else 0.0,
-            answer_log_probability=answer_log_probability,
-            quantization_error=(key_quantization_error + value_quantization_error) / 2,
-            key_quantization_error=key_quantization_error,
-            value_quantization_error=value_quantization_error,
-            attention_error=attention_error,
-            logit_error=logit_error,
-            average_size=(key_average_size + value_average_size) / 2,
-            key_average_size=key_average_size,
-            value_average_size=value_average_size,
-            average_n_bits=(key_average_n_bits + value_average_n_bits) / 2,
-            key_average_n_bits=key_average_n_bits,
-            value_average_n_bits=value_average_n_bits,
+            accuracy=accuracy,
+            # Calculate 95% confidence interval
+            accuracy_confidence=1.96 * math.sqrt(accuracy * (1.0 - accuracy) / question_count),
+            answer_log_probability=answer_log_probability / question_count,
+            quantization_error=quantization_error / question_count,
+            key_quantization_error=key_quantization_error / question_count,
+            value_quantization_error=value_quantization_error / question_count,
+            attention_error=attention_error / question_count,
+            logit_error=logit_error / question_count,
+            average_size=average_size / total_tokens,
+            key_average_size=key_average_size / total_tokens,
+            value_average_size=value_average_size / total_tokens,
+            average_n_bits=average_n_bits / total_tokens,
+            key_average_n_bits=key_average_n_bits / total_tokens,
+            value_average_n_bits=value_average_n_bits / total_tokens,
         )
 
-    def evaluate(self, model: LlamaForCausalLM, use_tqdm: bool) -> EvaluationResult:
+    def evaluate(self, model: LlamaForCausalLM, use_tqdm: bool, batch_size: int = 1) -> EvaluationResult:
         assert model.name_or_path == self.model_name
-        result = EvaluationResult()
-        total_tokens = 0
-        with torch.no_grad():
-            for idx, question in enumerate(tqdm(self.datasets.questions) if use_tqdm else self.datasets.questions):
-                single_result = self._evaluate_single(model, question)
-                n_tokens = question.question_length
-                total_tokens += n_tokens
-                result.accuracy += single_result.accuracy
-                result.answer_log_probability += single_result.answer_log_probability
-                result.quantization_error += single_result.quantization_error
-                result.key_quantization_error += single_result.key_quantization_error
-                result.value_quantization_error += single_result.value_quantization_error
-                result.attention_error += single_result.attention_error
-                result.logit_error += single_result.logit_error
-                result.average_size += single_result.average_size * n_tokens
-                result.key_average_size += single_result.key_average_size * n_tokens
-                result.value_average_size += single_result.value_average_size * n_tokens
-                result.average_n_bits += single_result.average_n_bits * n_tokens
-                result.key_average_n_bits += single_result.key_average_n_bits * n_tokens
-                result.value_average_n_bits += single_result.value_average_n_bits * n_tokens
-                if (idx + 1) % 100 == 0:
-                    gc.collect()
-        result.accuracy /= self.datasets.question_count
-        # Calculate 95% confidence interval
-        result.accuracy_confidence = 1.96 * math.sqrt(result.accuracy * (1.0 - result.accuracy) / self.datasets.question_count)
-        result.answer_log_probability /= self.datasets.question_count
-        result.quantization_error /= self.datasets.question_count
-        result.key_quantization_error /= self.datasets.question_count
-        result.value_quantization_error /= self.datasets.question_count
-        result.attention_error /= self.datasets.question_count
-        result.logit_error /= self.datasets.question_count
-        result.average_size /= total_tokens
-        result.key_average_size /= total_tokens
-        result.value_average_size /= total_tokens
-        result.average_n_bits /= total_tokens
-        result.key_average_n_bits /= total_tokens
-        result.value_average_n_bits /= total_tokens
-        return result
-    
+        totals, total_tokens = self._accumulate_metrics(model, self.datasets.questions, use_tqdm, batch_size)
+        # The only device-to-host sync of the whole evaluation
+        return self._build_result(totals.cpu().tolist(), total_tokens)
+
+    # Question-level data parallelism: every rank evaluates a strided shard of
+    # the questions on its own copy of the model, then the metric totals are
+    # summed across ranks. All ranks return the same full result.
+    def distributed_evaluate(self, model: LlamaForCausalLM, use_tqdm: bool, batch_size: int = 1) -> EvaluationResult:
+        assert model.name_or_path == self.model_name
+        if not dist.is_initialized():
+            dist.init_process_group("nccl")
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        questions = self.datasets.questions[rank::world_size]
+        totals, total_tokens = self._accumulate_metrics(model, questions, use_tqdm and rank == 0, batch_size)
+        # total_tokens rides along in the accumulator so one all_reduce covers
+        # everything
+        totals = torch.cat([totals, torch.tensor([total_tokens], dtype=torch.float64, device=self.device)])
+        dist.all_reduce(totals)
+        totals = totals.cpu().tolist()
+        return self._build_result(totals[:13], int(totals[13]))
+
+    @cached_property
+    def _params_key(self) -> str:
+        return _calc_params_key(self.params)
+
     def get_cached_result(self, cache_file: Optional[str]) -> Optional[EvaluationResult]:
         if cache_file is None or not os.path.exists(cache_file):
             return None
+        offset = _load_cache_index(cache_file).get(self._params_key)
+        if offset is None:
+            return None
         with open(cache_file, "r") as f:
-            cached_results = json.load(f)
-            for entry in cached_results:
-                if entry["params"] == self.params:
-                    return EvaluationResult(**entry["results"])
-        return None
+            f.seek(offset)
+            entry = json.loads(f.readline())
+        assert entry["params"] == self.params
+        return EvaluationResult(**entry["results"])
 
     def cache_result(self, cache_file: Optional[str], result: EvaluationResult):
         if cache_file is None:
             return
-        if os.path.exists(cache_file):
-            with open(cache_file, "r") as f:
-                cached_results = json.load(f)
-        else:
-            cached_results = []
-        cached_results.append({
-            "params": self.params,
-            "results": asdict(result),
-        })
-        with open(cache_file, "w") as f:
-            json.dump(cached_results, f, indent=4, separators=(", ", ": "))
+        # Results are appended as one JSON object per line, with a sidecar
+        # index mapping the params hash to the line's file offset, so neither
+        # lookups nor writes ever touch the whole file
+        with open(cache_file, "a") as f:
+            offset = f.tell()
+            json.dump({"params": self.params, "results": asdict(result)}, f)
+            f.write("\n")
+        with open(f"{cache_file}.idx", "a") as f:
+            f.write(f"{self._params_key} {offset}\n")
+
+
+def _calc_params_key(params: dict[str, Any]) -> str:
+    return hashlib.blake2b(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def _load_cache_index(cache_file: str) -> dict[str, int]:
+    index_file = f"{cache_file}.idx"
+    index: dict[str, int] = {}
+    if os.path.exists(index_file):
+        with open(index_file, "r") as f:
+            for line in f:
+                key, offset = line.split()
+                index[key] = int(offset)
+        return index
+    # Rebuild a missing index from the results file
+    with open(cache_file, "r") as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            index[_calc_params_key(json.loads(line)["params"])] = offset
+    with open(index_file, "w") as f:
+        for key, offset in index.items():
+            f.write(f"{key} {offset}\n")
+    return index
@@ -5,16 +5,17 @@ from tqdm import tqdm
 from pathlib import Path
 from .base import Experiment
 from config import device_configs
-from matplotlib import pyplot as plt
 
 
 class AttentionInsight(Experiment):
     def process_result(self, _):
+        # Imported lazily so evaluation workers never pay the matplotlib import
+        from matplotlib import pyplot as plt
         model = self.get_model(0)
         device = device_configs[0][0]
         question = self.questions[0]
         input_ids = question.input_ids[:1].to(device)
-        with torch.no_grad():
+        with torch.inference_mode():
             attention = model.forward(input_ids, output_attentions=True, return_dict=True).attentions
         attention = torch.stack(attention).detach().cpu().numpy()
         np.save("data/attention.npy", attention)
@@ -1,7 +1,6 @@
 from tqdm import tqdm
 from .base import Experiment
 from dataclasses import asdict
-from matplotlib import pyplot as plt
 from functools import cached_property
 from evaluator import EvaluationResult
 from quantizer import Quantizer, build_quantizers
@@ -12,6 +11,7 @@ params = [
     "method_name",
     "outliers_ratio",
     "use_attentions",
+    "per_channel",
     "n_bits_min",
     "n_bits_max",
     "last_n_attentions",
@@ -35,6 +35,7 @@ translation = {
     "method_name": "Method name",
     "outliers_ratio": "Outliers ratio",
     "use_attentions": "Attention-aware",
+    "per_channel": "Per-channel",
     "n_bits_min": "Min # of bits",
     "n_bits_max": "Max # of bits",
     "last_n_attentions": "Last n attentions",
@@ -97,6 +98,8 @@ class GridSearch(Experiment):
         return list(zip(key_quantizers, value_quantizers))
 
     def process_result(self, results: list[EvaluationResult]):
+        # Imported lazily so evaluation workers never pay the matplotlib import
+        from matplotlib import pyplot as plt
         plt.figure(figsize=(5*len(relations), 5*2*len(params)))
         for param_idx, param_name in enumerate(tqdm(params)):
             for relation_idx, (metric_name_x, metric_name_y) in enumerate(relations):
@@ -1,6 +1,5 @@
 from .base import Experiment
 from itertools import chain, product
-from matplotlib import pyplot as plt
 from functools import cached_property
 from evaluator import EvaluationResult
 from quantizer import Quantizer, build_quantizers
@@ -41,6 +40,8 @@ class KeyValueDifference(Experiment):
         ))
 
     def process_result(self, results: list[EvaluationResult]):
+        # Imported lazily so evaluation workers never pay the matplotlib import
+        from matplotlib import pyplot as plt
         enabled_series = ["token", "layer", "head"]
         series: dict[str, list[float]] = {}
         for (key_quantizer, value_quantizer), result in zip(self.quantizer_list, results):
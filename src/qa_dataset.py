@@ -46,8 +46,12 @@ class QADataset:
         question_choices = [question + " " + choice for choice in choices]
         results = self.tokenizer(question_choices, return_tensors="pt", padding=True, add_special_tokens=False, return_attention_mask=True)
         choices_len = (results.attention_mask.sum(dim=1) - question_len).tolist()
+        input_ids = results.input_ids
+        if torch.cuda.is_available():
+            # Pinned so the host-to-device copy can overlap with compute
+            input_ids = input_ids.pin_memory()
         return Question(
-            input_ids=results.input_ids,
+            input_ids=input_ids,
             question_length=question_len,
             choice_length=choices_len,
             question=question,
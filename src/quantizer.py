@@ -13,6 +13,16 @@ QuantizationLevels = Literal["no-quantization", "token", "layer", "head"]
 QuantizationMethods = Literal["uniform", "normal"]
 
 
+def _uniform_quantize_dequantize(cache: torch.Tensor, mean_value: torch.Tensor, scale_value: torch.Tensor, outlier_mask: torch.Tensor, n_bits: int) -> torch.Tensor:
+    # Kept as a free function of plain tensors so torch.compile can fuse the
+    # whole quantize->dequantize round trip into a single pass over the cache
+    normalized_cache = (cache - mean_value) / scale_value
+    quantized_cache = torch.clamp(torch.round(normalized_cache).to(torch.int32), -(2 ** (n_bits-1)), 2 ** (n_bits-1) - 1)
+    dequantized_cache = quantized_cache.to(cache.dtype)
+    denormalized_cache = dequantized_cache * scale_value + mean_value
+    return torch.where(outlier_mask, cache, denormalized_cache)
+
+
 class Quantizer:
     def __init__(self,
                  # Key cache or value cache
@@ -27,6 +37,10 @@ class Quantizer:
                  method: Optional[QuantizationMethods] = None,
                  # Percentage of outliers (including both lowest and highest)
                  outliers_ratio: Optional[float] = None,
+                 # (only applicable for key cache without attention-aware quantization)
+                 # KIVI-style layout: quantization groups run along the sequence
+                 # axis (per channel) instead of the channel axis (per token)
+                 per_channel: bool = False,
                  # Whether to enable attention-aware quantization
                  use_attentions: Optional[bool] = None,
                  # (only applicable for uniform quantization)
@@ -71,6 +85,10 @@ class Quantizer:
         # Set use_attentions:
         assert use_attentions is not None
         self.use_attentions = use_attentions
+        # Set per_channel (the attention-aware bit allocation reasons about
+        # tokens, so it cannot be combined with the transposed layout)
+        assert not (per_channel and (key_or_value_cache == "value" or use_attentions))
+        self.per_channel = per_channel
         if use_attentions:
             # Set last_n_attentions
             assert last_n_attentions is not None
@@ -109,6 +127,11 @@ class Quantizer:
     def set_dtype_and_device(self, dtype: torch.dtype, device: torch.device):
         self.dtype = dtype
         self.device = device
+        if self.level != "no-quantization" and self.method_name == "uniform":
+            # Compiled lazily here (in the worker process) rather than at
+            # construction time, since quantizers travel through a Queue before
+            # use and a compiled callable is not picklable
+            self._fused_uniform_quantize_dequantize = torch.compile(_uniform_quantize_dequantize, dynamic=True)
         if self.level != "no-quantization" and self.method_name == "normal":
             if self.use_attentions:
                 n_bits_range = range(self.n_bits_min, self.n_bits_max+1)
@@ -134,6 +157,10 @@ class Quantizer:
         res["method_name"] = self.method_name
         res["outliers_ratio"] = self.outliers_ratio
         res["use_attentions"] = self.use_attentions
+        # Only recorded when enabled so that existing cached results keep
+        # matching their params
+        if self.per_channel:
+            res["per_channel"] = self.per_channel
         if self.use_attentions:
             res["n_bits_min"] = self.n_bits_min
             res["n_bits_max"] = self.n_bits_max
@@ -211,8 +238,8 @@ class Quantizer:
         # mask.shape = (n_batch, seq_len, n_layer, n_head, embed_size_per_head)
         return mask
 
-    # Returns (normalized cache, mean value, scale value)
-    def _normalize(self, cache: torch.Tensor, method: Literal["minmax", "std"], n_bits: int, outlier_mask: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # Returns (mean value, scale value)
+    def _calc_normalization_stats(self, cache: torch.Tensor, method: Literal["minmax", "std"], n_bits: int, outlier_mask: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
         # cache/outlier_mask.shape: (n_count, n_layer, n_head, embed_size_per_head) or (n_count, n_head, embed_size_per_head), (n_count, embed_size_per_head)
         cache = torch.masked.masked_tensor(cache, torch.logical_not(outlier_mask))
         if self.symmetric:
@@ -229,13 +256,19 @@ class Quantizer:
                 min_value = cache.amin(dim=self.quantize_dims, keepdim=True)
                 scale_value = (max_value - min_value) / (2 ** n_bits)
             elif method == "std":
-                scale_value = cache.to(torch.float64).std(dim=self.quantize_dims, keepdim=True).to(self.dtype)
+                # FP32 is precise enough for roughly unit-normal cache values
+                # and halves the memory of the old FP64 upcast
+                scale_value = cache.to(torch.float32).std(dim=self.quantize_dims, keepdim=True).to(self.dtype)
         assert mean_value.get_mask().all()
         assert scale_value.get_mask().all()
-        cache = cache.get_data()
         mean_value = mean_value.get_data()
         scale_value = scale_value.get_data()
         # mean_value/scale_value.shape: (n_count, n_layer/1, n_head/1, embed_size_per_head/1) or (n_count, n_head/1, embed_size_per_head/1), (n_count, embed_size_per_head/1)
+        return mean_value, scale_value
+
+    # Returns (normalized cache, mean value, scale value)
+    def _normalize(self, cache: torch.Tensor, method: Literal["minmax", "std"], n_bits: int, outlier_mask: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        mean_value, scale_value = self._calc_normalization_stats(cache, method, n_bits, outlier_mask)
         normalized_cache = (cache - mean_value) / scale_value
         # normalized_cache.shape: (n_count, n_layer, n_head, embed_size_per_head) or (n_count, n_head, embed_size_per_head), (n_count, embed_size_per_head)
         return normalized_cache, mean_value, scale_value
@@ -245,12 +278,9 @@ class Quantizer:
 
     def _uniform_quantize(self, cache: torch.Tensor, n_bits: int, outlier_mask: torch.Tensor) -> torch.Tensor:
         # cache/outlier_mask.shape: (n_count, n_layer, n_head, embed_size_per_head) or (n_count, n_head, embed_size_per_head), (n_count, embed_size_per_head)
-        normalized_cache, mean_value, scale_value = self._normalize(cache, "minmax", n_bits, outlier_mask)
-        quantized_cache = torch.clamp(torch.round(normalized_cache).to(torch.int32), -(2 ** (n_bits-1)), 2 ** (n_bits-1) - 1)
-        dequantized_cache = quantized_cache.to(self.dtype)
-        denormalized_cache = self._denormalize(dequantized_cache, mean_value, scale_value)
+        mean_value, scale_value = self._calc_normalization_stats(cache, "minmax", n_bits, outlier_mask)
         # denormalized_cache.shape: (n_count, n_layer, n_head, embed_size_per_head) or (n_count, n_head, embed_size_per_head), (n_count, embed_size_per_head)
-        return torch.where(outlier_mask, cache, denormalized_cache)
+        return self._fused_uniform_quantize_dequantize(cache, mean_value, scale_value, outlier_mask, n_bits)
 
     def _normal_quantize(self, cache: torch.Tensor, n_bits: int, outlier_mask: torch.Tensor) -> torch.Tensor:
         # cache/outlier_mask.shape: (n_count, n_layer, n_head, embed_size_per_head) or (n_count, n_head, embed_size_per_head), (n_count, embed_size_per_head)
@@ -266,6 +296,10 @@ class Quantizer:
         if self.level == "no-quantization":
             return cache, torch.finfo(self.dtype).bits
         # cache.shape: (n_layer, n_batch, n_head, seq_len, embed_size_per_head)
+        if self.per_channel:
+            # Swap the sequence and channel axes so the per-channel reductions
+            # below read contiguous memory along the sequence axis
+            cache = cache.transpose(-2, -1).contiguous()
         cache = cache.permute(1, 3, 0, 2, 4)
         # cache.shape: (n_batch, seq_len, n_layer, n_head, embed_size_per_head)
         outlier_mask = self._calc_outlier_mask(cache)
@@ -280,6 +314,8 @@ class Quantizer:
             indices = torch.where(n_bits == n)
             cache[indices] = self.quantization_method(cache[indices], n_bits=n, outlier_mask=outlier_mask[indices])
         cache = cache.permute(2, 0, 3, 1, 4)
+        if self.per_channel:
+            cache = cache.transpose(-2, -1)
         # cache.shape: (n_layer, n_batch, n_head, seq_len, embed_size_per_head)
         return cache, average_n_bits
 